@@ -4,20 +4,43 @@ A script that performs a simple network analysis on any undirected, weighted edg
 
 # System tools
 import os
-import sys
 import glob
 import argparse
+import weakref
+from concurrent.futures import ProcessPoolExecutor
 
 # Data analysis
 import pandas as pd
-import math
 import numpy as np
-from collections import defaultdict
+import pyarrow as pa
+import pyarrow.csv as pv
+
+# optional JIT compilation of the scaling function
+try:
+    from numba import njit
+except ImportError:
+    njit = None
 
 # Network analysis tools
 import networkx as nx
+import matplotlib
+matplotlib.use('Agg') # no GUI backend, plots are only saved
 import matplotlib.pyplot as plt
 
+# the functions that make up the script
+__all__ = ['parse_args', 'read_df', 'scale', 'network_analysis', 'plot_network',
+           'network_csv', 'process_one', 'main']
+
+# the figure shared by the plots of a process
+figure = None
+
+# the layout functions by style, and the positions already computed for each graph
+LAYOUTS = {'spring': lambda G: nx.spring_layout(G, seed = 0),
+           'kamada_kawai': nx.kamada_kawai_layout,
+           'circular': nx.circular_layout,
+           'random': lambda G: nx.random_layout(G, seed = 0)}
+layout_cache = weakref.WeakKeyDictionary()
+
 
 def parse_args():
     '''
@@ -28,152 +51,341 @@ def parse_args():
     
     # command line parameters
     ap.add_argument("-f", "--file_input", required = True, help = "The filename or directory we want to work with")
-    ap.add_argument("-l", "--layout", required = False, default = 'spring', help = "The layout of the plot to be created by networkx (spring, kamada_kawai, circular, random)")
+    ap.add_argument("-l", "--layout", required = False, default = 'spring', choices = ['spring', 'kamada_kawai', 'circular', 'random'], help = "The layout of the plot to be created by networkx (spring, kamada_kawai, circular, random)")
     ap.add_argument("-node", "--node_size", required = False, default = 0, type = bool, help = "specifies whether the size of the nodes should be based on the degree of the node")
     ap.add_argument("-edge", "--edge_width", required = False, default = 0, type = bool, help = "specifies whether the width of the edges should be based on the weight of the connection")
+    ap.add_argument("-b", "--backend", required = False, default = 'networkx', choices = ['networkx', 'igraph', 'networkit'], help = "The library used to calculate the centrality measures (networkx, igraph, networkit)")
+    ap.add_argument("-np", "--no_plot", action = 'store_true', help = "Only the CSV files are created, the networks are not plotted")
+    ap.add_argument("-bc", "--bc_samples", required = False, default = 0, type = int, help = "The number of nodes sampled to approximate the betweenness centrality, 0 calculates the exact scores")
 
     args = vars(ap.parse_args())
+    
+    if args['bc_samples'] < 0:
+        ap.error("argument -bc/--bc_samples: must be 0 or a positive number of nodes")
+    
     return args
 
 
 def read_df(filepath):
     '''
-    Function that reads in a CSV file that's tab separated. it also returns the cleaned name of the file.
+    Function that reads in a CSV file that's tab separated. The node names are replaced by integer ids, and the names are returned in the order of the ids. it also returns the cleaned name of the file.
     
     filepath: the path to the CSV file.
     '''
-    df = pd.read_csv(filepath, sep = '\t')
+    # the edgelist columns are fixed, so pyarrow parses them with these types instead of inferring them
+    # node names stay strings, so e.g. 007 and 7 are different nodes, and empty or NA names are missing
+    convert_options = pv.ConvertOptions(column_types = {'Source': pa.string(), 'Target': pa.string(), 'Weight': pa.float32()},
+                                        strings_can_be_null = True)
+    table = pv.read_csv(filepath, parse_options = pv.ParseOptions(delimiter = '\t'), convert_options = convert_options)
+    df = table.to_pandas(types_mapper = pd.ArrowDtype)
+    
+    # mapping node names to integer ids, the id of a node is its position in names
+    # a missing name is kept as its own node instead of getting the id -1
+    codes, names = pd.factorize(pd.concat([df['Source'], df['Target']]), use_na_sentinel = False)
+    codes = codes.astype(np.int32)
+    df['Source'] = codes[:len(df)]
+    df['Target'] = codes[len(df):]
+    names = list(names)
     
     # cleaning filename
-    split_filename = filepath.split("/")[-1]
-    file_only = split_filename.split(".")[0]
+    file_only = os.path.splitext(os.path.basename(filepath))[0]
+    
+    return df, file_only, names
+
+
+def scale_kernel(x, a, b):
+    '''
+    Function that scales a contiguous array of values to a range between a and b. The minimum and maximum are found in a single pass, and the function is compiled with numba when it is installed. If all values are equal, they are placed in the middle of the range.
+    
+    x: array to be scaled
+    a: the minimum value of the new scale
+    b: the maximum value of the new scale
+    '''
+    xmin = x[0]
+    xmax = x[0]
+    for i in range(1, x.shape[0]):
+        if x[i] < xmin:
+            xmin = x[i]
+        elif x[i] > xmax:
+            xmax = x[i]
+    
+    xnormalized = np.empty_like(x)
+    if xmax == xmin:
+        xnormalized[:] = (a + b) / 2
+        return xnormalized
     
-    return df, file_only
+    for i in range(x.shape[0]):
+        xnormalized[i] = (b - a) * ((x[i] - xmin) / (xmax - xmin)) + a
+    return xnormalized
+
+
+if njit is not None:
+    scale_kernel = njit(cache = True, fastmath = True)(scale_kernel)
 
 
 def scale(x, a, b):
     '''
-    Function that contains a formulat that scales an array of values to a range between a and b.
+    Function that contains a formulat that scales an array of values to a range between a and b. If all values are equal, they are placed in the middle of the range.
     
     x: array to be scaled
     a: the minimum value of the new scale
     b: the maximum value of the new scale
     '''
-    xnormalized = ((b - a) * ((x - min(x)) / (max(x) - min(x))) + a)  
+    # single precision is enough for plotting
+    x = np.ascontiguousarray(x, dtype = np.float32)
+    
+    if njit is not None:
+        return scale_kernel(x, a, b)
+    
+    xmin = x.min()
+    xmax = x.max()
+    if xmax == xmin:
+        return np.full_like(x, (a + b) / 2)
+    
+    xnormalized = ((b - a) * ((x - xmin) / (xmax - xmin)) + a)
     return xnormalized
        
 
-def network_analysis(df):
+def igraph_centrality(df, n_nodes, eigenvector = True):
     '''
-    Function that performs a network analysis on an edgelist. The graph object is returned along with the degree, eigenvector and betweenness centrality scores.
+    Function that calculates the eigenvector and betweenness centrality scores with igraph. The scores are scaled the same way as networkx scales them.
     
     df: dataframe of an edgelist with columns: source, target and weight.
+    n_nodes: the number of nodes in the network
+    eigenvector: whether the eigenvector centrality is calculated, otherwise it is returned as None
     '''
-    # create network
-    G = nx.from_pandas_edgelist(df, "Source", "Target", ["Weight"])
-     
+    import igraph as ig
+    
+    # create network, duplicate edges are merged like networkx does
+    g = ig.Graph(n = n_nodes, edges = list(zip(df['Source'].tolist(), df['Target'].tolist())))
+    g.simplify(multiple = True, loops = False)
+    n = g.vcount()
+    
     # calculating centrality measures
+    ev = None
+    if eigenvector:
+        scores = np.array(g.eigenvector_centrality(scale = False))
+        ev = dict(enumerate((scores / np.linalg.norm(scores)).tolist()))
+    betweenness = np.array(g.betweenness())
+    if n > 2:
+        betweenness = betweenness * 2 / ((n - 1) * (n - 2))
+    
+    bc = dict(enumerate(betweenness.tolist()))
+    
+    return ev, bc
+
+
+def networkit_centrality(df, n_nodes, bc_samples = 0, eigenvector = True):
+    '''
+    Function that calculates the eigenvector and betweenness centrality scores with NetworKit. The scores are scaled the same way as networkx scales them.
+    
+    df: dataframe of an edgelist with columns: source, target and weight.
+    n_nodes: the number of nodes in the network
+    bc_samples: the number of nodes sampled to approximate the betweenness, 0 calculates the exact scores
+    eigenvector: whether the eigenvector centrality is calculated, otherwise it is returned as None
+    '''
+    import networkit as nk
+    
+    # create network, duplicate edges are merged like networkx does
+    # networkit node ids are unsigned 64 bit integers
+    sources = df['Source'].to_numpy(dtype = np.uint64)
+    targets = df['Target'].to_numpy(dtype = np.uint64)
+    K = nk.GraphFromCoo((np.ones(len(sources)), (sources, targets)), n = n_nodes, directed = False, weighted = False)
+    K.removeMultiEdges()
+    
+    # calculating centrality measures
+    ev = None
+    if eigenvector:
+        scores = np.array(nk.centrality.EigenvectorCentrality(K).run().scores())
+        ev = dict(enumerate((scores / np.linalg.norm(scores)).tolist()))
+    if 0 < bc_samples < n_nodes:
+        betweenness = nk.centrality.EstimateBetweenness(K, bc_samples, normalized = True, parallel = True).run().scores()
+    else:
+        betweenness = nk.centrality.Betweenness(K, normalized = n_nodes > 2).run().scores()
+    
+    bc = dict(enumerate(betweenness))
+    
+    return ev, bc
+
+
+def network_analysis(df, backend = 'networkx', bc_samples = 0):
+    '''
+    Function that performs a network analysis on an edgelist. The graph object is returned along with the degree, eigenvector and betweenness centrality scores.
+    
+    df: dataframe of an edgelist with columns: source, target and weight. The nodes are integer ids.
+    backend: the library used to calculate the centrality measures (networkx, igraph or networkit)
+    bc_samples: the number of nodes sampled to approximate the betweenness, 0 calculates the exact scores
+    '''
+    # create network from the raw columns, the ids are python ints as they hash faster than numpy scalars
+    G = nx.Graph()
+    G.add_weighted_edges_from(zip(df['Source'].to_numpy().tolist(), df['Target'].to_numpy().tolist(), df['Weight'].to_numpy()), weight = 'Weight')
+     
+    # sampling is only used when it is fewer nodes than the network has
+    if bc_samples >= G.number_of_nodes():
+        bc_samples = 0
+    
+    # the eigenvector solvers disagree on networks of two nodes, disconnected networks or networks with self-loops, so every backend uses the networkx power iteration for them
+    solvable = G.number_of_nodes() > 2 and nx.is_connected(G) and nx.number_of_selfloops(G) == 0
+    
+    # the backends count self-loops differently, so the degree always comes from networkx
     dg = dict(G.degree())
-    ev = nx.eigenvector_centrality(G)
-    bc = nx.betweenness_centrality(G)
+    
+    # the centrality measures are unweighted, as in the igraph and networkit backends, so weight is set to None
+    # calculating centrality measures
+    if backend == 'igraph':
+        ev, bc = igraph_centrality(df, G.number_of_nodes(), solvable)
+    
+    elif backend == 'networkit':
+        ev, bc = networkit_centrality(df, G.number_of_nodes(), bc_samples, solvable)
+    
+    else: # default
+        if solvable:
+            ev = nx.eigenvector_centrality_numpy(G, weight = None) # sparse eigensolver
+        k = bc_samples if bc_samples > 0 else None
+        bc = nx.betweenness_centrality(G, k = k, seed = 0)
+    
+    if not solvable:
+        ev = nx.eigenvector_centrality(G, weight = None)
+    
+    # ordering the scores like the nodes of the graph, so the CSV file is the same for every backend
+    dg = {node: dg[node] for node in G}
+    ev = {node: ev[node] for node in G}
+    bc = {node: bc[node] for node in G}
     
     return G, dg, ev, bc
 
 
-def plot_network(G, df, file_name):
+def get_figure():
+    '''
+    Function that returns the figure shared by all plots in the process. The figure is cleared before it is returned, so the backend is only started once.
+    '''
+    global figure
+    
+    if figure is None:
+        with plt.rc_context({'figure.dpi': 150}):
+            figure = plt.figure(figsize=(10,10))
+    
+    figure.clear()
+    return figure
+
+
+def get_layout(G, plot_style):
+    '''
+    Function that returns the node positions of a graph in a layout style. The positions are computed once per graph and style, and are forgotten when the graph is deleted.
+    
+    G: a networkx graph object
+    plot_style: the layout of the plot (spring, kamada_kawai, circular, random)
+    '''
+    positions = layout_cache.setdefault(G, {})
+    
+    if plot_style not in positions:
+        positions[plot_style] = LAYOUTS[plot_style](G)
+    
+    return positions[plot_style]
+
+
+def plot_network(G, dg, df, names, file_name, args):
     '''
     Function that plots a network graph in different styles and saves it with the filename the graph was created from. Dependent on user input the nodesizes can vary by degree and the edge width can vary by weight.
     
     G: a networkx graph object
+    dg: dict of degree centrality scores
+    df: dataframe of the edgelist the graph was created from
+    names: the node names in the order of the node ids
     file_name: the filename we are working with
+    args: the parsed command line arguments
     '''
     # grabbing plot argument
-    args = parse_args()
     plot_style = args['layout']
     n = args['node_size']
     e = args['edge_width']
     
-    # calculate degree values for the node size 
-    dg = dict(G.degree())
-    node_sizes = []
-    for k,v in dg.items():
-        node_sizes.append(v)
-
-    # scale values
-    node_sizes = np.array(node_sizes)
-    node_sizes = scale(node_sizes, 1200, 3500)
-
-    # get weight for edge width
-    weight = df['Weight'].values
-    weight = scale(weight, 0.6, 7)
-    
     # setting standard values if the user input is 0
-    if args['node_size'] == 0:
-        node_sizes = 2000
-        
-    if args['edge_width'] == 0:
-        weight = 0.75
-        
-    f = plt.figure(figsize=(10,10))
-    f.tight_layout()
-
-    # drawing the network by style
-    if plot_style == 'circular':
-        nx.draw_circular(G, with_labels=True, width = weight,
-                         alpha = 0.9, node_size = node_sizes,
-                         node_color = 'lightgrey', font_size=10,
-                         edgecolors = 'blue')
-    
-    elif plot_style == 'kamada_kawai':
-        nx.draw_kamada_kawai(G, with_labels=True, width = weight,
-                             alpha = 0.9, node_size = node_sizes,
-                             node_color = 'lightgrey', font_size=10,
-                             edgecolors = 'blue')
-        
-    elif plot_style == 'spring': # default
-        nx.draw_spring(G, with_labels=True, width = weight,
-                         alpha = 0.9, node_size = node_sizes,
-                         node_color = 'lightgrey', font_size=10,
-                         edgecolors = 'blue')
-    
-    elif plot_style == 'random':
-        nx.draw_random(G, with_labels=True, width = weight,
-                         alpha = 0.9, node_size = node_sizes,
-                         node_color = 'lightgrey', font_size=10,
-                         edgecolors = 'blue')
+    node_sizes = 2000
+    weight = 0.75
+    
+    if args['node_size'] != 0:
+        # degree values for the node size, in the node order of the graph
+        node_sizes = np.fromiter((dg[node] for node in G), dtype = np.float32, count = len(dg))
+        node_sizes = scale(node_sizes, 1200, 3500)
+    
+    if args['edge_width'] != 0:
+        # get weight for edge width
+        weight = df['Weight'].values
+        weight = scale(weight, 0.6, 7)
+    
+    # labelling the node ids with their names
+    labels = dict(enumerate(names))
         
+    # reusing the figure of the process, cleared for this plot
+    fig = get_figure()
+    ax = fig.subplots()
+    fig.subplots_adjust(left = 0, right = 1, bottom = 0, top = 1)
+
+    # drawing the network with the layout positions
+    pos = get_layout(G, plot_style)
+    nx.draw(G, pos, with_labels=True, labels = labels, width = weight,
+            alpha = 0.9, node_size = node_sizes,
+            node_color = 'lightgrey', font_size=10,
+            edgecolors = 'blue', ax = ax)
+    
     # saving the plot
     outpath = os.path.join('output', f'{file_name}_{plot_style}_{n}_{e}.png')
-    plt.savefig(outpath, bbox_inches='tight')
+    fig.savefig(outpath)
     return
 
 
-def network_csv(dg, ev, bc, file_name):
+def network_csv(dg, ev, bc, names, file_name):
     '''
     Function that creates a CSV file for a network containing centrality measures.
     
     dg: dict of degree centrality scores
     ev: dict of eigen vector centrality scores
     bc: dict of betweenness centrality scores 
+    names: the node names in the order of the node ids
+    file_name: the filename we are working with
     '''
-    # creating dict
-    dd = defaultdict(list)
-    
-    # listing input dicts, and matching by key in each
-    for d in (dg, ev, bc): 
-        for key, value in d.items():
-            dd[key].append(value)
-    
-    # creating pandas dataframe from the dictionary        
-    df_network = pd.DataFrame.from_dict(dd, orient = 'index', columns = ['Degree', 'Eigenvector','Betweenness'])
+    # creating pandas dataframe from the dicts, matched by key
+    df_network = pd.DataFrame({'Degree': dg, 'Eigenvector': ev, 'Betweenness': bc})
+    df_network.index = [names[node] for node in df_network.index]
     df_network = df_network.rename_axis("Name").reset_index()
     
     outpath = os.path.join('output', f'{file_name}_network.csv')
     df_network.to_csv(outpath, index = False)
     
     return
+
+
+def process_one(file, args):
+    '''
+    Function that performs the network analysis on a single file and saves the CSV file and, unless disabled, the plot.
+    
+    file: the path to the CSV file.
+    args: the parsed command line arguments
+    '''
+    df, filename, names = read_df(file)
+    G, dg, ev, bc = network_analysis(df, args['backend'], args['bc_samples'])
+    network_csv(dg, ev, bc, names, filename)
+    
+    if not args['no_plot']:
+        plot_network(G, dg, df, names, filename, args)
+    
+    return
  
     
+def init_worker(backend):
+    '''
+    Function that runs when a worker process starts. The processes already use every core, so networkit is limited to a single thread in each of them.
+    
+    backend: the library used to calculate the centrality measures
+    '''
+    if backend == 'networkit':
+        import networkit as nk
+        nk.setNumberOfThreads(1)
+    
+    return
+
+
 def main():
     '''
     The process of the script.
@@ -182,14 +394,14 @@ def main():
     args = parse_args()
     input_name = args['file_input']
     
+    if args['backend'] == 'igraph' and args['bc_samples'] > 0:
+        print('[INFO] igraph does not sample the betweenness centrality. Exact scores are calculated ...')
+    
     isFile = os.path.isfile(input_name)
     if isFile == True:
         
         print('[INFO] Input is a file. Network analysis ...')
-        df, filename = read_df(input_name)
-        G, dg, ev, bc = network_analysis(df)
-        network_csv(dg, ev, bc, filename)
-        plot_network(G, df, filename)
+        process_one(input_name, args)
         
         print('[INFO] Script success.')
 
@@ -200,11 +412,9 @@ def main():
         joined_paths = glob.glob(os.path.join(input_name, '*.csv'))
         
         print('[INFO] Input is a directory. Network analysis ...')
-        for file in joined_paths:
-            df, filename = read_df(file)
-            G, dg, ev, bc = network_analysis(df)
-            network_csv(dg, ev, bc, filename)
-            plot_network(G, df, filename)
+        # each file is independent, so they are processed in parallel
+        with ProcessPoolExecutor(max_workers = os.cpu_count(), initializer = init_worker, initargs = (args['backend'],)) as executor:
+            list(executor.map(process_one, joined_paths, [args] * len(joined_paths)))
         
         print('[INFO] Script success.')
                 